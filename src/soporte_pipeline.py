@@ -0,0 +1,420 @@
+# Librerías para tratamiento de datos
+import pandas as pd
+import json
+
+# Librerías para calcular la huella de cada paso y saber si está al día
+import hashlib
+import inspect
+
+# Librerías para ejecutar en paralelo las ramas independientes del pipeline
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Librerías para gestionar ficheros, tiempos y argumentos de la línea de comandos
+import os
+import shutil
+import time
+import argparse
+
+# Funciones y variables del proyecto
+from src import soporte_funciones as sf
+from src import soporte_variables as sv
+
+
+# -------------------------------------- #
+
+# Este script encadena los pasos de los notebooks 1 y 2 (captura, transformación, ficheros finales y carga en la base
+# de datos) como un grafo de dependencias. Cada paso guarda la huella de sus entradas, de modo que sólo se vuelve
+# a ejecutar cuando éstas cambian, y las ramas de cada fuente se ejecutan en procesos separados.
+#
+# Uso desde la raíz del repositorio:
+#     python -m src.soporte_pipeline                        # actualiza los ficheros finales que no estén al día
+#     python -m src.soporte_pipeline --refrescar            # vuelve a descargar todas las fuentes
+#     python -m src.soporte_pipeline --database alquileresmadrid   # además carga la base de datos
+#     python -m src.soporte_pipeline --estado               # muestra qué pasos están al día
+
+# -------------------------------------- #
+
+ruta_datos = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datos")
+ruta_estado = os.path.join(sf.ruta_cache, "pipeline.json")
+
+# Parámetros de las descargas de cada fuente (los mismos que se usaron en el notebook 1).
+parametros_descarga = {
+    "airbnb": {"destino": "Madrid", "checkin": "2025-01-31", "checkout": "2025-02-02", "paginas": 11},
+    "idealista": {"locationId": "0-EU-ES-28-07-001-079", "locationName": "Madrid", "paginas": 10},
+    "redpiso": {"paginas": 50},
+}
+
+
+def _ruta(relativa):
+    """
+    Devuelve la ruta absoluta de un fichero de `datos` a partir de su ruta relativa ("origen/airbnb.json").
+    """
+    return os.path.join(ruta_datos, relativa)
+
+
+def _guardar_final(df, nombre, formato):
+    """
+    Guarda un fichero final en su formato original (sin el identificador del anuncio, como en los notebooks)
+    y en Parquet/GeoParquet con el identificador.
+    """
+    original = df.drop(columns=[columna for columna in sv.columnas_id_anuncio if columna in df.columns])
+    if formato == "geojson":
+        original.to_file(_ruta(f"finales/{nombre}.geojson"), driver="GeoJSON")
+    else:
+        original.to_csv(_ruta(f"finales/{nombre}.csv"))
+    sf.guardar_parquet(df, nombre, _ruta("finales"))
+
+
+def _leer_json(relativa):
+    with open(_ruta(relativa), "r") as fichero:
+        return json.load(fichero)
+
+
+def _guardar_paginas(paginas, relativa):
+    """
+    Guarda las páginas descargadas de una API. Si no ha llegado ninguna (sin conexión o sin cuota), se lanza un error
+    en lugar de sobrescribir la descarga anterior, y los pasos que dependen de ella no se ejecutan.
+    """
+    if not paginas:
+        raise RuntimeError(f"La descarga no ha devuelto ninguna página; se mantiene {relativa}")
+    with open(_ruta(relativa), "w") as fichero:
+        json.dump(paginas, fichero, indent=4)
+
+
+# --------- Pasos ---------
+
+def descargar_airbnb():
+    _guardar_paginas(sf.consulta_airbnbs(**parametros_descarga["airbnb"]), "origen/airbnb.json")
+
+
+def descargar_idealista():
+    _guardar_paginas(sf.consulta_idealista(**parametros_descarga["idealista"]), "origen/idealista.json")
+
+
+def descargar_redpiso():
+    with sf.PoolNavegadores(tamanio=4) as pool:
+        sf.scraping_alquileres_redpiso(parametros_descarga["redpiso"]["paginas"], _ruta("origen/redpiso"), pool=pool)
+
+
+def descargar_poblacion():
+    # Sin la dirección de exportación del Ayuntamiento en el .env, la serie se descarga con el navegador
+    if sf.url_csv_ayuntamiento:
+        sf.descargar_referencias(_ruta("origen"), series=["poblacion"])
+    else:
+        shutil.move(sf.scraping_ayuntamiento(), _ruta("origen/extranjeros_madrid.csv"))
+
+
+def descargar_ingresos():
+    sf.descargar_referencias(_ruta("origen"), series=["ingresos"])
+
+
+def final_distritos():
+    _guardar_final(sf.gdf_distritos_final(_ruta("origen/madrid-districts.geojson")), "distritos", "geojson")
+
+
+def final_airbnb():
+    indice = sf.IndiceDistritos(_ruta("origen/madrid-districts.geojson"))
+    _guardar_final(sf.transformar_airbnb(_leer_json("origen/airbnb.json"), indice=indice), "airbnb", "geojson")
+
+
+def final_idealista():
+    indice = sf.IndiceDistritos(_ruta("origen/madrid-districts.geojson"))
+    _guardar_final(sf.transformar_idealista(_leer_json("origen/idealista.json"), indice=indice), "idealista", "geojson")
+
+
+def final_redpiso():
+    carpeta = _ruta("origen/redpiso")
+    paginas = sorted(os.path.join(carpeta, nombre) for nombre in os.listdir(carpeta) if nombre.startswith("pagina-"))
+    _guardar_final(sf.transformar_redpiso(paginas), "redpiso", "csv")
+
+
+def final_poblacion():
+    _guardar_final(sf.leer_poblacion_ayuntamiento(_ruta("origen/extranjeros_madrid.csv")), "poblacion", "csv")
+
+
+def final_ingresos():
+    _guardar_final(sf.leer_ingresos_ine(_ruta("origen/ingresos_hogares_distrito.csv")), "ingresos_hogares", "csv")
+
+
+def final_hexagonos():
+    # El estado de cada anuncio va en la caché de la misma carpeta de datos que los agregados
+    rejilla = sf.RejillaHexagonal(ruta_anuncios=_ruta("cache/hexagonos_anuncios.parquet"),
+                                  ruta_celdas=_ruta("finales/hexagonos.parquet"))
+    for fuente in sv.fuentes_hex:
+        rejilla.actualizar(fuente, sf.leer_parquet(fuente, carpeta=_ruta("finales")))
+    rejilla.guardar()
+
+
+def cargar_base_datos(database):
+    """
+    Carga los ficheros finales en la base de datos: crea las tablas (versión 1 del esquema), sustituye con COPY
+    las tablas de referencia (distritos, población e ingresos), aplica el resto de migraciones (índices, resumen
+    y claves de los anuncios) sobre las tablas ya cargadas, carga los anuncios como instantáneas incrementales
+    y refresca el resumen por distrito.
+    """
+    # Los índices se crean después de la carga masiva, como indica `dbeaver_aplicar_esquema`
+    sf.dbeaver_aplicar_esquema(database, 1)
+
+    referencia = [
+        ("distritos", "distritos", sv.columnas_copy_distritos),
+        ("poblacion", "poblacion", sv.columnas_copy_poblacion),
+        ("ingresos_hogar", "ingresos_hogares", sv.columnas_copy_ingreso_hogar),
+    ]
+    with sf.dbeaver_transaccion(database) as cursor:
+        for tabla, nombre, columnas in referencia:
+            df = sf.leer_parquet(nombre, carpeta=_ruta("finales"))
+            if tabla == "distritos":
+                # Los distritos no se borran: el resto de tablas los referencian con borrado en cascada
+                cursor.execute("SELECT id_distrito FROM distritos;")
+                df = df[~df["ID_Distrito"].isin([fila[0] for fila in cursor.fetchall()])]
+            else:
+                cursor.execute(f"DELETE FROM {tabla};")
+            sf.dbeaver_copy(cursor.connection, tabla, df, columnas)
+
+    # Las instantáneas usan la clave de los anuncios y el resumen por distrito, que llegan en las últimas migraciones
+    sf.dbeaver_aplicar_esquema(database)
+
+    for tabla in sv.tablas_instantanea:
+        sf.dbeaver_instantanea(database, tabla, sf.leer_parquet(tabla, carpeta=_ruta("finales")))
+
+    sf.dbeaver_refrescar_resumen(database, completo=True)
+
+
+# Grafo de pasos: función, pasos de los que depende, ficheros (o carpetas) que lee y que escribe, relativos a `datos`.
+# Los pasos `fuente` descargan datos externos: sólo se repiten si faltan sus salidas o se pide `--refrescar`.
+pasos = {
+    "descargar_airbnb": {"funcion": descargar_airbnb, "dependencias": [], "entradas": [],
+                         "salidas": ["origen/airbnb.json"], "fuente": True},
+    "descargar_idealista": {"funcion": descargar_idealista, "dependencias": [], "entradas": [],
+                            "salidas": ["origen/idealista.json"], "fuente": True},
+    "descargar_redpiso": {"funcion": descargar_redpiso, "dependencias": [], "entradas": [],
+                          "salidas": ["origen/redpiso"], "fuente": True},
+    "descargar_poblacion": {"funcion": descargar_poblacion, "dependencias": [], "entradas": [],
+                            "salidas": ["origen/extranjeros_madrid.csv"], "fuente": True},
+    "descargar_ingresos": {"funcion": descargar_ingresos, "dependencias": [], "entradas": [],
+                           "salidas": ["origen/ingresos_hogares_distrito.csv"], "fuente": True},
+    "distritos": {"funcion": final_distritos, "dependencias": [], "entradas": ["origen/madrid-districts.geojson"],
+                  "salidas": ["finales/distritos.geojson", "finales/distritos.parquet"]},
+    "airbnb": {"funcion": final_airbnb, "dependencias": ["descargar_airbnb"],
+               "entradas": ["origen/airbnb.json", "origen/madrid-districts.geojson"],
+               "salidas": ["finales/airbnb.geojson", "finales/airbnb.parquet"]},
+    "idealista": {"funcion": final_idealista, "dependencias": ["descargar_idealista"],
+                  "entradas": ["origen/idealista.json", "origen/madrid-districts.geojson"],
+                  "salidas": ["finales/idealista.geojson", "finales/idealista.parquet"]},
+    "redpiso": {"funcion": final_redpiso, "dependencias": ["descargar_redpiso"], "entradas": ["origen/redpiso"],
+                "salidas": ["finales/redpiso.csv", "finales/redpiso.parquet"]},
+    "poblacion": {"funcion": final_poblacion, "dependencias": ["descargar_poblacion"],
+                  "entradas": ["origen/extranjeros_madrid.csv"],
+                  "salidas": ["finales/poblacion.csv", "finales/poblacion.parquet"]},
+    "ingresos": {"funcion": final_ingresos, "dependencias": ["descargar_ingresos"],
+                 "entradas": ["origen/ingresos_hogares_distrito.csv"],
+                 "salidas": ["finales/ingresos_hogares.csv", "finales/ingresos_hogares.parquet"]},
+    "hexagonos": {"funcion": final_hexagonos, "dependencias": ["airbnb", "idealista"],
+                  "entradas": ["finales/airbnb.parquet", "finales/idealista.parquet"],
+                  "salidas": ["finales/hexagonos.parquet"]},
+    "cargar_db": {"funcion": cargar_base_datos, "dependencias": ["distritos", "airbnb", "idealista", "redpiso", "poblacion", "ingresos"],
+                  "entradas": [f"finales/{nombre}.parquet" for nombre in sv.esquemas_parquet], "salidas": []},
+}
+
+
+# --------- Ejecución ---------
+
+def _huella_fichero(ruta, huella):
+    """
+    Añade a la huella el contenido de un fichero, o de todos los ficheros de una carpeta en orden.
+    """
+    if os.path.isdir(ruta):
+        for nombre in sorted(os.listdir(ruta)):
+            huella.update(nombre.encode())
+            _huella_fichero(os.path.join(ruta, nombre), huella)
+    elif os.path.exists(ruta):
+        with open(ruta, "rb") as fichero:
+            for bloque in iter(lambda: fichero.read(1 << 20), b""):
+                huella.update(bloque)
+    else:
+        huella.update(b"<no existe>")
+
+
+def huella_paso(nombre, argumentos=()):
+    """
+    Calcula la huella de un paso: el código de su función y de los módulos `soporte_funciones` y `soporte_variables` que usa
+    (salvo en las fuentes), sus argumentos y el contenido de sus entradas. Si no cambia ninguno de ellos, la salida del paso tampoco cambia y no hace falta volver a ejecutarlo.
+
+    Parámetros:
+    nombre (str): El nombre del paso en `pasos`.
+    argumentos (tuple): Los argumentos con los que se ejecuta la función del paso.
+
+    Devuelve:
+    str: La huella en hexadecimal (sha256).
+    """
+    paso = pasos[nombre]
+    huella = hashlib.sha256()
+    # En las fuentes sólo cuentan los parámetros de la descarga: cambiar el código no obliga a volver a descargar
+    if not paso.get("fuente"):
+        huella.update(inspect.getsource(paso["funcion"]).encode())
+        # Las funciones de los pasos llaman a `sf` y usan las constantes y consultas de `sv`: un cambio en ellos también cuenta
+        for modulo in (sf, sv):
+            _huella_fichero(inspect.getsourcefile(modulo), huella)
+    huella.update(json.dumps([argumentos, parametros_descarga.get(nombre.replace("descargar_", ""))], default=str).encode())
+    for entrada in paso["entradas"]:
+        huella.update(entrada.encode())
+        _huella_fichero(_ruta(entrada), huella)
+    return huella.hexdigest()
+
+
+def _leer_estado():
+    if os.path.exists(ruta_estado):
+        with open(ruta_estado, "r") as fichero:
+            return json.load(fichero)
+    return {}
+
+
+def _guardar_estado(estado):
+    os.makedirs(os.path.dirname(ruta_estado), exist_ok=True)
+    with open(ruta_estado, "w") as fichero:
+        json.dump(estado, fichero, indent=4, sort_keys=True)
+
+
+def _ejecutar_paso(nombre, argumentos):
+    """
+    Ejecuta la función de un paso en el proceso de trabajo y devuelve los segundos que ha tardado.
+    """
+    inicio = time.perf_counter()
+    pasos[nombre]["funcion"](*argumentos)
+    return time.perf_counter() - inicio
+
+
+def _con_dependencias(seleccion):
+    """
+    Devuelve los pasos seleccionados junto con todos los pasos de los que dependen.
+    """
+    resultado = set()
+    pendientes = list(seleccion)
+    while pendientes:
+        nombre = pendientes.pop()
+        if nombre not in resultado:
+            resultado.add(nombre)
+            pendientes.extend(pasos[nombre]["dependencias"])
+    return resultado
+
+
+def _al_dia(nombre, huella, estado):
+    """
+    Indica si un paso está al día: su última ejecución tenía la misma huella y todas sus salidas existen.
+    """
+    salidas_existen = all(os.path.exists(_ruta(salida)) for salida in pasos[nombre]["salidas"])
+    if pasos[nombre].get("fuente"):
+        # Una fuente sólo se vuelve a descargar si cambian sus parámetros; si sus ficheros ya existen sin haberlos
+        # descargado el pipeline (por ejemplo, desde los notebooks), se dan por buenos
+        return salidas_existen and estado.get(nombre, huella) == huella
+    return salidas_existen and estado.get(nombre) == huella
+
+
+def ejecutar_pipeline(seleccion=None, database=None, refrescar=False, forzar=(), procesos=None):
+    """
+    Ejecuta los pasos del pipeline que no estén al día, en orden de dependencias y en paralelo cuando son
+    independientes (cada fuente descarga y se transforma en su propio proceso).
+
+    Parámetros:
+    seleccion (list): Pasos a actualizar, junto con los pasos de los que dependen (por defecto, todos menos `cargar_db`).
+    database (str): Si se indica, se añade el paso `cargar_db` sobre esta base de datos.
+    refrescar (bool): Si es True, vuelve a descargar todas las fuentes seleccionadas (por defecto es False).
+    forzar (list): Pasos que se ejecutan aunque estén al día.
+    procesos (int): Número máximo de procesos en paralelo (por defecto, uno por paso que se pueda ejecutar a la vez).
+
+    Devuelve:
+    DataFrame: Una fila por paso con su resultado ("ejecutado", "al día", "error" u "omitido") y los segundos.
+    """
+    seleccion = list(seleccion or [nombre for nombre in pasos if nombre != "cargar_db"])
+    if database and "cargar_db" not in seleccion:
+        seleccion.append("cargar_db")
+    desconocidos = [nombre for nombre in seleccion if nombre not in pasos]
+    if desconocidos:
+        raise ValueError(f"Pasos desconocidos: {desconocidos}. Pasos disponibles: {list(pasos)}")
+
+    argumentos = {nombre: (database,) if nombre == "cargar_db" else () for nombre in pasos}
+    forzar = set(forzar) | ({nombre for nombre in pasos if pasos[nombre].get("fuente")} if refrescar else set())
+    pendientes = _con_dependencias(seleccion)
+    estado = _leer_estado()
+    resultados = {}
+    en_curso = {}
+    inicio_total = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=procesos or len(pendientes)) as ejecutor:
+        while pendientes or en_curso:
+            for nombre in sorted(pendientes):
+                dependencias = [resultados.get(dependencia) for dependencia in pasos[nombre]["dependencias"]]
+                if any(dependencia is None for dependencia in dependencias):
+                    continue
+                pendientes.discard(nombre)
+
+                if any(dependencia["resultado"] in ("error", "omitido") for dependencia in dependencias):
+                    resultados[nombre] = {"resultado": "omitido", "segundos": 0.0}
+                    continue
+                huella = huella_paso(nombre, argumentos[nombre])
+                if nombre not in forzar and _al_dia(nombre, huella, estado):
+                    resultados[nombre] = {"resultado": "al día", "segundos": 0.0}
+                    continue
+                print(f"[pipeline] Ejecutando {nombre}")
+                en_curso[ejecutor.submit(_ejecutar_paso, nombre, argumentos[nombre])] = (nombre, huella)
+
+            if not en_curso:
+                continue
+            terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                nombre, huella = en_curso.pop(futuro)
+                try:
+                    segundos = futuro.result()
+                    resultados[nombre] = {"resultado": "ejecutado", "segundos": round(segundos, 2)}
+                    estado[nombre] = huella
+                    _guardar_estado(estado)
+                    print(f"[pipeline] {nombre} terminado en {segundos:.2f} s")
+                except Exception as e:
+                    resultados[nombre] = {"resultado": "error", "segundos": 0.0, "error": repr(e)}
+                    print(f"[pipeline] Error en {nombre}: {e}")
+
+    print(f"[pipeline] Tiempo total: {time.perf_counter() - inicio_total:.2f} s")
+    return pd.DataFrame([{"paso": nombre, **resultado} for nombre, resultado in resultados.items()])
+
+
+def estado_pipeline(database=None):
+    """
+    Indica, sin ejecutar nada, qué pasos del pipeline están al día.
+
+    Parámetros:
+    database (str): Base de datos del paso `cargar_db` (por defecto, ninguna).
+
+    Devuelve:
+    DataFrame: Una fila por paso con sus dependencias y si está al día. La huella de un paso depende de las salidas
+    de los pasos anteriores, así que un paso que vaya detrás de otro pendiente puede cambiar de estado al ejecutarlo.
+    """
+    estado = _leer_estado()
+    return pd.DataFrame([{
+        "paso": nombre,
+        "dependencias": ", ".join(paso["dependencias"]),
+        "al_dia": _al_dia(nombre, huella_paso(nombre, (database,) if nombre == "cargar_db" else ()), estado),
+    } for nombre, paso in pasos.items()])
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Pipeline de extracción, transformación y carga de alquileres en Madrid.")
+    parser.add_argument("pasos", nargs="*", help=f"Pasos a actualizar (por defecto, todos). Disponibles: {', '.join(pasos)}")
+    parser.add_argument("--database", help="Base de datos en la que cargar los ficheros finales")
+    parser.add_argument("--refrescar", action="store_true", help="Vuelve a descargar todas las fuentes")
+    parser.add_argument("--forzar", nargs="*", default=[], help="Pasos que se ejecutan aunque estén al día")
+    parser.add_argument("--procesos", type=int, help="Número máximo de procesos en paralelo")
+    parser.add_argument("--estado", action="store_true", help="Muestra qué pasos están al día sin ejecutar nada")
+    opciones = parser.parse_args(argumentos)
+
+    if opciones.estado:
+        print(estado_pipeline(opciones.database).to_string(index=False))
+        return
+
+    resultado = ejecutar_pipeline(opciones.pasos, opciones.database, opciones.refrescar, opciones.forzar, opciones.procesos)
+    print(resultado.to_string(index=False))
+    if (resultado["resultado"] == "error").any():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
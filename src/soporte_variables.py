@@ -72,6 +72,240 @@ query_creacion_poblacion='''
         total INT
     );'''
 
+# --------- Índices ---------
+
+# Se crean después de la carga masiva, para no mantener los índices fila a fila durante la inserción.
+
+query_indices_claves_foraneas = '''
+    create index if not exists idx_airbnb_id_distrito on airbnb (id_distrito);
+    create index if not exists idx_idealista_id_distrito on idealista (id_distrito);
+    create index if not exists idx_redpiso_id_distrito on redpiso (id_distrito);
+'''
+
+query_indices_espaciales = '''
+    create index if not exists idx_distritos_geometry on distritos using gist (geometry);
+    create index if not exists idx_airbnb_geometry on airbnb using gist (geometry);
+    create index if not exists idx_idealista_geometry on idealista using gist (geometry);
+'''
+
+query_indices_periodo = '''
+    create index if not exists idx_poblacion_distrito_periodo on poblacion (id_distrito, periodo);
+    create index if not exists idx_ingresos_hogar_distrito_periodo on ingresos_hogar (id_distrito, periodo);
+'''
+
+# Actualiza las estadísticas del planificador tras crear los índices.
+query_analyze = '''
+    analyze;
+'''
+
+# --------- Resumen por distrito ---------
+
+# Tabla con los agregados por distrito y fecha de instantánea que leen los gráficos, para no recalcularlos
+# a partir de todos los anuncios en cada consulta.
+query_creacion_resumen_distrito = '''
+    create table if not exists resumen_distrito(
+        id_distrito INT
+            references distritos(id_distrito)
+            on update cascade
+            on delete cascade,
+        fecha DATE,
+        precio_idealista NUMERIC,
+        anuncios_idealista INT,
+        precio_redpiso NUMERIC,
+        anuncios_redpiso INT,
+        precio_airbnb NUMERIC,
+        anuncios_airbnb INT,
+        alquiler_prom NUMERIC,
+        ingreso_prom_hogar FLOAT,
+        porc_alquiler_ingreso FLOAT,
+        var_espanoles INT,
+        var_extranjeros INT,
+        actualizado TIMESTAMP default now(),
+        primary key (id_distrito, fecha)
+    );'''
+
+# Distritos con anuncios insertados, modificados o borrados desde el último refresco del resumen.
+query_creacion_distritos_pendientes = '''
+    create table if not exists distritos_pendientes(
+        id_distrito INT primary key
+    );'''
+
+# Los triggers son por sentencia y usan tablas de transición, de modo que una carga masiva con COPY
+# marca cada distrito una sola vez en lugar de una vez por fila.
+query_funcion_distritos_pendientes = '''
+    create or replace function marcar_distritos_pendientes() returns trigger as $$
+    begin
+        if TG_OP in ('INSERT', 'UPDATE') then
+            insert into distritos_pendientes (id_distrito)
+            select distinct id_distrito from nuevas where id_distrito is not null
+            on conflict do nothing;
+        end if;
+        if TG_OP in ('DELETE', 'UPDATE') then
+            insert into distritos_pendientes (id_distrito)
+            select distinct id_distrito from antiguas where id_distrito is not null
+            on conflict do nothing;
+        end if;
+        return null;
+    end;
+    $$ language plpgsql;'''
+
+query_triggers_distritos_pendientes = "".join(f'''
+    drop trigger if exists trg_{tabla}_insert on {tabla};
+    create trigger trg_{tabla}_insert after insert on {tabla}
+        referencing new table as nuevas
+        for each statement execute function marcar_distritos_pendientes();
+    drop trigger if exists trg_{tabla}_update on {tabla};
+    create trigger trg_{tabla}_update after update on {tabla}
+        referencing old table as antiguas new table as nuevas
+        for each statement execute function marcar_distritos_pendientes();
+    drop trigger if exists trg_{tabla}_delete on {tabla};
+    create trigger trg_{tabla}_delete after delete on {tabla}
+        referencing old table as antiguas
+        for each statement execute function marcar_distritos_pendientes();
+''' for tabla in ["idealista", "redpiso", "airbnb"])
+
+# Al crear el resumen, todos los distritos quedan pendientes para que el primer refresco lo calcule entero.
+query_todos_distritos_pendientes = '''
+    insert into distritos_pendientes (id_distrito)
+    select id_distrito from distritos
+    on conflict do nothing;'''
+
+# Toma (y vacía) la lista de distritos pendientes.
+query_tomar_distritos_pendientes = '''
+    delete from distritos_pendientes returning id_distrito;'''
+
+# Recalcula el resumen de los distritos %(distritos)s para la fecha %(fecha)s, agregando cada fuente por separado.
+query_refrescar_resumen_distrito = '''
+WITH idealista_distrito AS (
+    SELECT id_distrito, AVG(precio) AS precio, COUNT(*) AS anuncios
+    FROM idealista
+    WHERE id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+redpiso_distrito AS (
+    SELECT id_distrito, AVG(precio) AS precio, COUNT(*) AS anuncios
+    FROM redpiso
+    WHERE id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+airbnb_distrito AS (
+    SELECT id_distrito, AVG(precio) AS precio, COUNT(*) AS anuncios
+    FROM airbnb
+    WHERE id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+ingresos_distrito AS (
+    SELECT id_distrito, AVG(total) / 12 AS ingreso_mensual
+    FROM ingresos_hogar
+    WHERE id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+poblacion_distrito AS (
+    SELECT id_distrito, SUM(espanioles) AS var_espanoles, SUM(extranjeros) AS var_extranjeros
+    FROM poblacion
+    WHERE id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+resumen AS (
+    SELECT d.id_distrito,
+        i.precio AS precio_idealista,
+        COALESCE(i.anuncios, 0) AS anuncios_idealista,
+        r.precio AS precio_redpiso,
+        COALESCE(r.anuncios, 0) AS anuncios_redpiso,
+        a.precio AS precio_airbnb,
+        COALESCE(a.anuncios, 0) AS anuncios_airbnb,
+        (COALESCE(i.precio, r.precio) + COALESCE(r.precio, i.precio)) / 2 AS alquiler_prom,
+        ih.ingreso_mensual,
+        p.var_espanoles,
+        p.var_extranjeros
+    FROM distritos d
+    LEFT JOIN idealista_distrito i ON d.id_distrito = i.id_distrito
+    LEFT JOIN redpiso_distrito r ON d.id_distrito = r.id_distrito
+    LEFT JOIN airbnb_distrito a ON d.id_distrito = a.id_distrito
+    LEFT JOIN ingresos_distrito ih ON d.id_distrito = ih.id_distrito
+    LEFT JOIN poblacion_distrito p ON d.id_distrito = p.id_distrito
+    WHERE d.id_distrito = ANY(%(distritos)s::int[])
+)
+INSERT INTO resumen_distrito (id_distrito, fecha, precio_idealista, anuncios_idealista, precio_redpiso, anuncios_redpiso,
+    precio_airbnb, anuncios_airbnb, alquiler_prom, ingreso_prom_hogar, porc_alquiler_ingreso, var_espanoles,
+    var_extranjeros, actualizado)
+SELECT id_distrito, %(fecha)s, precio_idealista, anuncios_idealista, precio_redpiso, anuncios_redpiso,
+    precio_airbnb, anuncios_airbnb, alquiler_prom, ingreso_mensual, alquiler_prom / NULLIF(ingreso_mensual, 0),
+    var_espanoles, var_extranjeros, now()
+FROM resumen
+ON CONFLICT (id_distrito, fecha) DO UPDATE SET
+    precio_idealista = EXCLUDED.precio_idealista,
+    anuncios_idealista = EXCLUDED.anuncios_idealista,
+    precio_redpiso = EXCLUDED.precio_redpiso,
+    anuncios_redpiso = EXCLUDED.anuncios_redpiso,
+    precio_airbnb = EXCLUDED.precio_airbnb,
+    anuncios_airbnb = EXCLUDED.anuncios_airbnb,
+    alquiler_prom = EXCLUDED.alquiler_prom,
+    ingreso_prom_hogar = EXCLUDED.ingreso_prom_hogar,
+    porc_alquiler_ingreso = EXCLUDED.porc_alquiler_ingreso,
+    var_espanoles = EXCLUDED.var_espanoles,
+    var_extranjeros = EXCLUDED.var_extranjeros,
+    actualizado = EXCLUDED.actualizado
+;'''
+
+# Última instantánea de cada distrito (o la de la fecha %(fecha)s, si no es nula), con el nombre del distrito.
+query_leer_resumen_distrito = '''
+SELECT DISTINCT ON (rd.id_distrito) d.nombre, rd.*
+FROM resumen_distrito rd
+INNER JOIN distritos d ON d.id_distrito = rd.id_distrito
+WHERE %(fecha)s::date IS NULL OR rd.fecha = %(fecha)s::date
+ORDER BY rd.id_distrito, rd.fecha DESC
+;'''
+
+# --------- Instantáneas de anuncios ---------
+
+# Cada anuncio lleva una clave estable de su fuente y un hash de su contenido, para que cada carga escriba
+# sólo los anuncios nuevos, modificados o retirados en lugar de recargar la tabla entera.
+tablas_instantanea = ["airbnb", "idealista", "redpiso"]
+
+query_claves_anuncios = "".join(f'''
+    alter table {tabla}
+        add column if not exists clave VARCHAR,
+        add column if not exists hash_contenido BIGINT,
+        add column if not exists fecha_alta DATE,
+        add column if not exists fecha_modificacion DATE;
+    create unique index if not exists uq_{tabla}_clave on {tabla} (clave);
+''' for tabla in tablas_instantanea)
+
+# Historial de altas, cambios y bajas de cada anuncio, con el precio en cada evento.
+query_creacion_historial_anuncios = '''
+    create table if not exists historial_anuncios(
+        fuente VARCHAR(20),
+        clave VARCHAR,
+        fecha DATE,
+        evento VARCHAR(10),
+        precio INT,
+        primary key (fuente, clave, fecha)
+    );'''
+
+# --------- Versiones del esquema ---------
+
+query_creacion_version_esquema = '''
+    create table if not exists esquema_version(
+        version INT primary key,
+        aplicada TIMESTAMP default now()
+    );'''
+
+# Cada versión agrupa las consultas que llevan el esquema desde la versión anterior hasta ella.
+# La versión 1 crea las tablas; la 2 crea los índices y se aplica después de cargar los datos;
+# la 3 crea el resumen por distrito y los triggers que marcan los distritos a refrescar;
+# la 4 añade la clave y el hash de contenido de los anuncios y el historial para las cargas incrementales.
+migraciones_esquema = {
+    1: [query_creacion_distritos, query_creacion_airbnb, query_creacion_idealista, query_creacion_redpiso,
+        query_creacion_ingreso_hogar, query_creacion_poblacion],
+    2: [query_indices_claves_foraneas, query_indices_espaciales, query_indices_periodo, query_analyze],
+    3: [query_creacion_resumen_distrito, query_creacion_distritos_pendientes, query_funcion_distritos_pendientes,
+        query_triggers_distritos_pendientes, query_todos_distritos_pendientes],
+    4: [query_claves_anuncios, query_creacion_historial_anuncios],
+}
+
+version_esquema = max(migraciones_esquema)
+
 # --------- Inserción ---------
 
 query_inser_distritos = '''
@@ -103,3 +337,468 @@ query_inser_poblacion = '''
     INSERT INTO poblacion (id_distrito, periodo, espanioles, extranjeros, total)
     values (%s, %s, %s, %s, %s);
 '''
+
+# --------- Distritos y barrios ---------
+
+# Nombres de los distritos tal y como aparecen en datos/origen/madrid-districts.geojson
+nombres_distritos = {
+    1: "Centro",
+    2: "Arganzuela",
+    3: "Retiro",
+    4: "Salamanca",
+    5: "Chamartin",
+    6: "Tetuan",
+    7: "Chamberi",
+    8: "Fuencarral-El Pardo",
+    9: "Moncloa-Aravaca",
+    10: "Latina",
+    11: "Carabanchel",
+    12: "Usera",
+    13: "Puente de Vallecas",
+    14: "Moratalaz",
+    15: "Ciudad Lineal",
+    16: "Hortaleza",
+    17: "Villaverde",
+    18: "Villa de Vallecas",
+    19: "Vicalvaro",
+    20: "San Blas",
+    21: "Barajas",
+}
+
+# Nombres de distritos, barrios, zonas conocidas y alias de cada ID_Distrito, para localizar direcciones.
+# Las tildes y las mayúsculas no importan, porque se normalizan antes de buscar.
+gazetteer_distritos = {
+    1: ["Centro", "Palacio", "Embajadores", "Cortes", "Justicia", "Universidad", "Sol",
+        "La Latina", "Lavapiés", "Malasaña", "Chueca", "Huertas", "Barrio de las Letras", "Ópera"],
+    2: ["Arganzuela", "Imperial", "Acacias", "Chopera", "Legazpi", "Delicias", "Palos de Moguer",
+        "Palos de la Frontera", "Atocha", "Madrid Río"],
+    3: ["Retiro", "Pacífico", "Adelfas", "Estrella", "Ibiza", "Jerónimos", "Niño Jesús"],
+    4: ["Salamanca", "Barrio de Salamanca", "Recoletos", "Goya", "Fuente del Berro", "Guindalera", "Lista", "Castellana"],
+    5: ["Chamartín", "El Viso", "Prosperidad", "Ciudad Jardín", "Hispanoamérica", "Nueva España", "Castilla"],
+    6: ["Tetuán", "Tetuán de las Victorias", "Bellas Vistas", "Cuatro Caminos", "Castillejos", "Almenara",
+        "Valdeacederas", "Berruguete"],
+    7: ["Chamberí", "Gaztambide", "Arapiles", "Trafalgar", "Almagro", "Ríos Rosas", "Vallehermoso"],
+    8: ["Fuencarral-El Pardo", "Fuencarral", "El Pardo", "Fuentelarreina", "Peñagrande", "Pilar", "Barrio del Pilar",
+        "La Paz", "Valverde", "Mirasierra", "El Goloso", "Las Tablas", "Montecarmelo", "Tres Olivos",
+        "Arroyo del Fresno"],
+    9: ["Moncloa-Aravaca", "Moncloa", "Aravaca", "Casa de Campo", "Argüelles", "Ciudad Universitaria", "Valdezarza",
+        "Valdemarín", "El Plantío"],
+    10: ["Latina", "Los Cármenes", "Puerta del Ángel", "Lucero", "Aluche", "Campamento", "Cuatro Vientos",
+         "Las Águilas"],
+    11: ["Carabanchel", "Comillas", "Opañel", "San Isidro", "Vista Alegre", "Puerta Bonita", "Buenavista",
+         "Abrantes", "PAU de Carabanchel"],
+    12: ["Usera", "Orcasitas", "Orcasur", "San Fermín", "Almendrales", "Moscardó", "Zofío", "Pradolongo"],
+    13: ["Puente de Vallecas", "Entrevías", "San Diego", "Palomeras Bajas", "Palomeras Sureste", "Portazgo",
+         "Numancia"],
+    14: ["Moratalaz", "Pavones", "Horcajo", "Marroquina", "Media Legua", "Fontarrón", "Vinateros"],
+    15: ["Ciudad Lineal", "Ventas", "Pueblo Nuevo", "Quintana", "Concepción", "San Pascual", "San Juan Bautista",
+         "Colina", "Atalaya", "Costillares", "La Elipa"],
+    16: ["Hortaleza", "Palomas", "Piovera", "Canillas", "Pinar del Rey", "Apóstol Santiago", "Valdefuentes",
+         "Sanchinarro", "Valdebebas", "Virgen del Cortijo", "Conde Orgaz"],
+    17: ["Villaverde", "Villaverde Alto", "Villaverde Bajo", "San Andrés", "San Cristóbal", "Butarque",
+         "Los Rosales", "Los Ángeles"],
+    18: ["Villa de Vallecas", "Casco Histórico de Vallecas", "Santa Eugenia", "Ensanche de Vallecas",
+         "PAU de Vallecas"],
+    19: ["Vicálvaro", "Casco Histórico de Vicálvaro", "Valdebernardo", "Valderrivas", "Valderribas",
+         "El Cañaveral", "Ambroz"],
+    20: ["San Blas", "San Blas-Canillejas", "Simancas", "Hellín", "Amposta", "Arcos", "Rosas", "Las Rosas", "Rejas",
+         "Canillejas", "Salvador"],
+    21: ["Barajas", "Alameda de Osuna", "Aeropuerto", "Casco Histórico de Barajas", "Timón", "Corralejos"],
+}
+
+# --------- Carga masiva (COPY) ---------
+
+# Columnas de cada tabla en el orden en que se envían con COPY; deben coincidir con el orden de columnas del DataFrame.
+columnas_copy_distritos = ["id_distrito", "nombre", "geometry"]
+
+columnas_copy_airbnb = ["id_distrito", "precio", "descripcion", "geometry"]
+
+columnas_copy_idealista = ["id_distrito", "precio", "tipo", "planta", "tamanio", "habitaciones", "banios", "direccion", "descripcion", "geometry"]
+
+columnas_copy_redpiso = ["id_distrito", "precio", "descripcion"]
+
+columnas_copy_ingreso_hogar = ["id_distrito", "periodo", "total"]
+
+columnas_copy_poblacion = ["id_distrito", "periodo", "espanioles", "extranjeros", "total"]
+
+# --------- Cargas incrementales ---------
+
+# Columnas de cada tabla que forman el contenido del anuncio (en el orden de COPY), y columnas que identifican
+# el anuncio cuando la fuente no trae un identificador propio.
+columnas_instantanea = {
+    "airbnb": columnas_copy_airbnb,
+    "idealista": columnas_copy_idealista,
+    "redpiso": columnas_copy_redpiso,
+}
+
+columnas_identidad_instantanea = {
+    "airbnb": ["descripcion", "geometry"],
+    "idealista": ["tipo", "tamanio", "direccion", "geometry"],
+    "redpiso": ["descripcion"],
+}
+
+# Columnas con el identificador del anuncio en la fuente (`ID_Anuncio` en Airbnb e Idealista, `URL` en Redpiso).
+columnas_id_anuncio = ["ID_Anuncio", "URL"]
+
+# Tabla temporal donde se copia la instantánea; se borra al terminar la transacción.
+query_staging_instantanea = {tabla: f'''
+    create temp table instantanea_{tabla} (like {tabla}) on commit drop;
+    alter table instantanea_{tabla} drop column id_{tabla}, drop column fecha_alta, drop column fecha_modificacion;
+''' for tabla in tablas_instantanea}
+
+# Anota en el historial los anuncios nuevos y los que han cambiado de contenido, antes de escribirlos.
+query_historial_instantanea = {tabla: f'''
+    insert into historial_anuncios (fuente, clave, fecha, evento, precio)
+    select '{tabla}', n.clave, %(fecha)s, case when t.clave is null then 'alta' else 'cambio' end, n.precio
+    from instantanea_{tabla} n
+    left join {tabla} t on t.clave = n.clave
+    where t.clave is null or t.hash_contenido is distinct from n.hash_contenido
+    on conflict (fuente, clave, fecha) do update set evento = excluded.evento, precio = excluded.precio
+    returning evento;
+''' for tabla in tablas_instantanea}
+
+# Borra los anuncios que ya no aparecen en la instantánea (y las filas cargadas antes de tener clave),
+# dejando la baja en el historial.
+query_bajas_instantanea = {tabla: f'''
+    with bajas as (
+        delete from {tabla} t
+        where t.clave is null
+            or not exists (select 1 from instantanea_{tabla} n where n.clave = t.clave)
+        returning t.clave, t.precio
+    )
+    insert into historial_anuncios (fuente, clave, fecha, evento, precio)
+    select '{tabla}', clave, %(fecha)s, 'baja', precio from bajas where clave is not null
+    on conflict (fuente, clave, fecha) do update set evento = excluded.evento, precio = excluded.precio;
+''' for tabla in tablas_instantanea}
+
+# Inserta los anuncios nuevos y actualiza los modificados; los que no han cambiado no se tocan.
+query_upsert_instantanea = {tabla: f'''
+    insert into {tabla} ({", ".join(columnas)}, clave, hash_contenido, fecha_alta, fecha_modificacion)
+    select {", ".join(columnas)}, clave, hash_contenido, %(fecha)s, %(fecha)s
+    from instantanea_{tabla} n
+    where not exists (
+        select 1 from {tabla} t where t.clave = n.clave and t.hash_contenido = n.hash_contenido
+    )
+    on conflict (clave) do update set
+        {", ".join(f"{columna} = excluded.{columna}" for columna in columnas)},
+        hash_contenido = excluded.hash_contenido,
+        fecha_modificacion = excluded.fecha_modificacion;
+''' for tabla, columnas in columnas_instantanea.items()}
+
+# Historial de un anuncio (o de todos los de una fuente, si la clave es nula), del más antiguo al más reciente.
+query_historial_anuncios = '''
+SELECT fuente, clave, fecha, evento, precio
+FROM historial_anuncios
+WHERE fuente = %(fuente)s AND (%(clave)s::varchar IS NULL OR clave = %(clave)s::varchar)
+ORDER BY clave, fecha
+;'''
+
+# --------- Consultas de análisis ---------
+
+# Consultas del notebook 3_QueriesVisualizaciónAnálisis, para poder revisar sus planes de ejecución con EXPLAIN ANALYZE.
+
+query_precio_distrito = '''
+SELECT d.nombre, 
+    round(AVG(i.precio),2) AS avg_precio_idealista, 
+    round(AVG(r.precio),2) AS avg_precio_redpiso,
+    round(AVG(i.precio)+AVG(r.precio)/2,2) AS alquiler_prom
+FROM distritos d
+INNER JOIN idealista i ON d.id_distrito = i.id_distrito
+INNER JOIN redpiso r ON d.id_distrito = r.id_distrito
+INNER JOIN airbnb a ON d.id_distrito = a.id_distrito
+GROUP BY d.nombre
+ORDER BY alquiler_prom DESC
+;'''
+
+query_alquiler_ingreso = '''
+SELECT d.nombre, 
+    round(AVG(i.precio)+AVG(r.precio)/2,2) AS alquiler_prom, 
+    AVG(ih.total)/12 AS ingreso_prom_hogar,
+    (AVG(i.precio)+AVG(r.precio)/2) / (AVG(ih.total)/12) AS porc_alquiler_ingreso
+FROM distritos d
+INNER JOIN idealista i ON d.id_distrito = i.id_distrito
+INNER JOIN redpiso r ON d.id_distrito = r.id_distrito
+INNER JOIN ingresos_hogar ih ON d.id_distrito = ih.id_distrito
+GROUP BY d.nombre
+ORDER BY porc_alquiler_ingreso DESC
+;'''
+
+query_precios_fuente = '''
+SELECT 
+    'Idealista' AS fuente,
+    precio 
+FROM 
+    idealista
+UNION ALL
+SELECT 
+    'Redpiso' AS fuente,
+    precio 
+FROM 
+    redpiso
+;'''
+
+query_anuncios_distrito = '''
+SELECT d.nombre, 
+     (SELECT COUNT(*)
+            FROM idealista i
+            WHERE i.id_distrito = d.id_distrito) AS idealista, 
+     (SELECT COUNT(*)
+            FROM redpiso r
+            WHERE r.id_distrito = d.id_distrito) AS redpiso, 
+     (SELECT COUNT(*)
+            FROM airbnb a
+            WHERE a.id_distrito = d.id_distrito) AS airbnb,
+     (SELECT COUNT(*)
+            FROM idealista i
+            WHERE i.id_distrito = d.id_distrito) + 
+     (SELECT COUNT(*)
+            FROM redpiso r
+            WHERE r.id_distrito = d.id_distrito) AS total_alquileres
+FROM distritos d
+;'''
+
+query_poblacion_distrito = '''
+SELECT d.nombre, 
+       SUM(p.espanioles) AS total_espanoles, 
+       SUM(p.extranjeros) AS total_extranjeros, 
+       SUM(p.total) AS total_cambio
+FROM distritos d
+INNER JOIN poblacion p ON d.id_distrito = p.id_distrito
+GROUP BY d.nombre
+ORDER BY total_cambio DESC
+;'''
+
+query_analisis_distrito = '''
+WITH Airbnb AS (
+    SELECT id_distrito, COUNT(*) AS cantidad_airbnbs 
+    FROM airbnb 
+    GROUP BY id_distrito
+),
+Poblacion AS (
+    SELECT id_distrito, SUM(espanioles) AS var_espanoles, SUM(extranjeros) AS var_extranjeros 
+    FROM poblacion 
+    GROUP BY id_distrito
+),
+Idealista AS (
+    SELECT id_distrito, AVG(precio) AS precio_idealista 
+    FROM idealista 
+    GROUP BY id_distrito
+),
+Redpiso AS (
+    SELECT id_distrito, AVG(precio) AS precio_redpiso 
+    FROM redpiso 
+    GROUP BY id_distrito
+)
+
+SELECT 
+    d.nombre AS distrito, 
+    (AVG(i.precio_idealista) + AVG(r.precio_redpiso)) / 2 AS precio_medio_alquiler, 
+    p.var_espanoles, 
+    p.var_extranjeros,
+    a.cantidad_airbnbs
+FROM 
+    distritos d
+LEFT JOIN 
+    Poblacion p ON d.id_distrito = p.id_distrito
+LEFT JOIN 
+    Idealista i ON d.id_distrito = i.id_distrito
+LEFT JOIN 
+    Redpiso r ON d.id_distrito = r.id_distrito
+LEFT JOIN 
+    Airbnb a ON d.id_distrito = a.id_distrito
+GROUP BY 
+    d.nombre, p.var_espanoles, p.var_extranjeros, a.cantidad_airbnbs
+ORDER BY
+    var_extranjeros DESC, var_espanoles DESC
+;'''
+
+query_precio_airbnb = '''
+SELECT 
+    round(AVG(precio),2) AS precio_promedio_airbnb
+FROM 
+    airbnb;
+'''
+
+query_geometria_distritos = '''
+SELECT 
+    id_distrito, nombre, ST_AsText(geometry) AS geometry
+FROM 
+    distritos;
+'''
+
+consultas_analisis = {
+    "precio_distrito": query_precio_distrito,
+    "alquiler_ingreso": query_alquiler_ingreso,
+    "precios_fuente": query_precios_fuente,
+    "anuncios_distrito": query_anuncios_distrito,
+    "poblacion_distrito": query_poblacion_distrito,
+    "analisis_distrito": query_analisis_distrito,
+    "precio_airbnb": query_precio_airbnb,
+    "geometria_distritos": query_geometria_distritos,
+}
+
+# --------- Consultas de análisis por distrito (agregadas) ---------
+
+# Versiones de query_precio_distrito y query_alquiler_ingreso que agregan cada fuente por distrito antes de unirlas,
+# en lugar de unir todos los anuncios entre sí (idealista x redpiso x airbnb filas por distrito) y promediar después.
+# Parámetros: %(distritos)s (lista de ID_Distrito, o None para todos) y %(periodo)s (año de ingresos, o None para todos).
+
+query_precio_distrito_agregado = '''
+WITH idealista_distrito AS (
+    SELECT id_distrito, AVG(precio) AS avg_precio, COUNT(*) AS anuncios
+    FROM idealista
+    WHERE %(distritos)s::int[] IS NULL OR id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+redpiso_distrito AS (
+    SELECT id_distrito, AVG(precio) AS avg_precio, COUNT(*) AS anuncios
+    FROM redpiso
+    WHERE %(distritos)s::int[] IS NULL OR id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+airbnb_distrito AS (
+    SELECT id_distrito, COUNT(*) AS anuncios
+    FROM airbnb
+    WHERE %(distritos)s::int[] IS NULL OR id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+)
+SELECT d.nombre,
+    round(i.avg_precio, 2) AS avg_precio_idealista,
+    round(r.avg_precio, 2) AS avg_precio_redpiso,
+    round((i.avg_precio + r.avg_precio) / 2, 2) AS alquiler_prom,
+    COALESCE(a.anuncios, 0) AS cantidad_airbnbs
+FROM distritos d
+INNER JOIN idealista_distrito i ON d.id_distrito = i.id_distrito
+INNER JOIN redpiso_distrito r ON d.id_distrito = r.id_distrito
+LEFT JOIN airbnb_distrito a ON d.id_distrito = a.id_distrito
+ORDER BY alquiler_prom DESC
+;'''
+
+query_alquiler_ingreso_agregado = '''
+WITH idealista_distrito AS (
+    SELECT id_distrito, AVG(precio) AS avg_precio
+    FROM idealista
+    WHERE %(distritos)s::int[] IS NULL OR id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+redpiso_distrito AS (
+    SELECT id_distrito, AVG(precio) AS avg_precio
+    FROM redpiso
+    WHERE %(distritos)s::int[] IS NULL OR id_distrito = ANY(%(distritos)s::int[])
+    GROUP BY id_distrito
+),
+ingresos_distrito AS (
+    SELECT id_distrito, AVG(total) / 12 AS ingreso_mensual
+    FROM ingresos_hogar
+    WHERE (%(distritos)s::int[] IS NULL OR id_distrito = ANY(%(distritos)s::int[]))
+        AND (%(periodo)s::int IS NULL OR periodo = %(periodo)s::int)
+    GROUP BY id_distrito
+)
+SELECT d.nombre,
+    round((i.avg_precio + r.avg_precio) / 2, 2) AS alquiler_prom,
+    ih.ingreso_mensual AS ingreso_prom_hogar,
+    ((i.avg_precio + r.avg_precio) / 2) / ih.ingreso_mensual AS porc_alquiler_ingreso
+FROM distritos d
+INNER JOIN idealista_distrito i ON d.id_distrito = i.id_distrito
+INNER JOIN redpiso_distrito r ON d.id_distrito = r.id_distrito
+INNER JOIN ingresos_distrito ih ON d.id_distrito = ih.id_distrito
+ORDER BY porc_alquiler_ingreso DESC
+;'''
+
+# --------- Ficheros finales ---------
+
+# Fichero de datos/finales de cada tabla y columnas de la tabla, en el mismo orden que las columnas del fichero.
+ficheros_finales = {
+    "distritos": ("distritos.geojson", columnas_copy_distritos),
+    "airbnb": ("airbnb.geojson", columnas_copy_airbnb),
+    "idealista": ("idealista.geojson", columnas_copy_idealista),
+    "redpiso": ("redpiso.csv", columnas_copy_redpiso),
+    "ingresos_hogar": ("ingresos_hogares.csv", columnas_copy_ingreso_hogar),
+    "poblacion": ("poblacion.csv", columnas_copy_poblacion),
+}
+
+# --------- Almacenamiento en Parquet ---------
+
+# Esquema de cada fichero final en Parquet: columnas en orden y tipo de cada una ("geometry" para la geometría en WKB).
+# Los nombres de columna son los mismos que en los GeoJSON y CSV originales, para poder usarlos indistintamente.
+# Las columnas con el identificador del anuncio en la fuente (`ID_Anuncio`, `URL`) son opcionales: los ficheros
+# generados por el pipeline las incluyen y los que vienen de los notebooks no.
+esquemas_parquet = {
+    "distritos": {"ID_Distrito": "int16", "Distrito": "string", "geometry": "geometry"},
+    "airbnb": {"ID_Distrito": "int16", "Precio Total": "int32", "Descripcion": "string", "geometry": "geometry",
+               "ID_Anuncio": "string"},
+    "idealista": {"ID_Distrito": "int16", "Precio": "float64", "Tipo": "string", "Planta": "string", "Tamanio": "int32",
+                  "Habitaciones": "int16", "Banios": "int16", "Direccion": "string", "Descripcion": "string",
+                  "geometry": "geometry", "ID_Anuncio": "string"},
+    "redpiso": {"ID_Distrito": "int16", "Precio": "int32", "Descripcion": "string", "URL": "string"},
+    "poblacion": {"ID_Distrito": "int16", "Periodo": "int16", "Espaniola": "int32", "Extranjera": "int32", "Total": "int32"},
+    "ingresos_hogares": {"ID_Distrito": "int16", "Periodo": "int16", "Total": "float64"},
+}
+
+# --------- Descargas directas de datos de referencia ---------
+
+# Exportaciones en CSV de las series de referencia, que se descargan sin navegador. El INE publica cada tabla completa
+# en una URL fija ("csv_bdsc" es el CSV separado por ";") y `leer_ingresos_ine` se queda con los distritos de Madrid.
+# El banco de datos del Ayuntamiento genera el CSV con la petición que envía su botón «Generar CSV»; esa dirección
+# se indica en el .env (`url_csv_ayuntamiento`) y, si no está, la serie se sigue descargando con el navegador.
+descargas_referencia = {
+    "ingresos": {"url": "https://www.ine.es/jaxiT3/files/t/es/csv_bdsc/31097.csv", "params": {"nocab": 1},
+                 "fichero": "ingresos_hogares_distrito.csv"},
+    "poblacion": {"url": None, "params": {}, "fichero": "extranjeros_madrid.csv"},
+}
+
+# --------- Rejilla hexagonal de precios ---------
+
+# Lado en metros (en ETRS89 / UTM 30N) de los hexágonos de cada resolución de la rejilla de precios,
+# de la más gruesa (distritos y barrios grandes) a la más fina (unas pocas manzanas).
+resoluciones_hex = {1: 2000, 2: 1000, 3: 500, 4: 250}
+
+# Fuentes con coordenadas que se agregan en la rejilla.
+fuentes_hex = ["airbnb", "idealista"]
+
+# --------- Comparables ---------
+
+# Peso de cada característica en la búsqueda de comparables, en metros equivalentes por unidad: con un peso de 10
+# para el tamaño, dos pisos iguales salvo por 10 m² están tan "lejos" como dos pisos idénticos separados 100 metros.
+# La distancia entre dos anuncios es la euclídea entre sus coordenadas (en metros) y sus características ponderadas.
+pesos_comparables = {"Tamanio": 10, "Habitaciones": 250, "Banios": 250}
+
+# Comparables de varios pisos a la vez en PostGIS. Para cada piso, el operador KNN `<->` recorre el índice espacial
+# de `idealista` y devuelve los %(candidatos)s anuncios más cercanos, que se ordenan después por la distancia
+# combinada con las características (las que el piso no indica, no cuentan). Los pisos se pasan como arrays paralelos.
+query_comparables_idealista = '''
+WITH consultas AS (
+    SELECT n - 1 AS consulta, tamanio, habitaciones, banios,
+        ST_SetSRID(ST_MakePoint(longitud, latitud), 4326) AS punto
+    FROM unnest(%(latitudes)s::float8[], %(longitudes)s::float8[], %(tamanios)s::float8[],
+                %(habitaciones)s::float8[], %(banios)s::float8[])
+        WITH ORDINALITY AS c(latitud, longitud, tamanio, habitaciones, banios, n)
+),
+candidatos AS (
+    SELECT c.consulta, i.id_idealista, i.id_distrito, i.precio, i.tipo, i.tamanio, i.habitaciones, i.banios, i.direccion,
+        ST_Distance(i.geometry::geography, c.punto::geography) AS distancia_m,
+        c.tamanio AS tamanio_consulta, c.habitaciones AS habitaciones_consulta, c.banios AS banios_consulta
+    FROM consultas c
+    CROSS JOIN LATERAL (
+        SELECT *
+        FROM idealista a
+        ORDER BY a.geometry <-> c.punto
+        LIMIT %(candidatos)s
+    ) i
+),
+puntuados AS (
+    SELECT *,
+        sqrt(power(distancia_m, 2)
+            + power(%(peso_tamanio)s * COALESCE(tamanio - tamanio_consulta, 0), 2)
+            + power(%(peso_habitaciones)s * COALESCE(habitaciones - habitaciones_consulta, 0), 2)
+            + power(%(peso_banios)s * COALESCE(banios - banios_consulta, 0), 2)) AS distancia
+    FROM candidatos
+)
+SELECT consulta, orden, distancia_m, distancia, id_idealista, id_distrito, precio, tipo, tamanio, habitaciones, banios, direccion
+FROM (
+    SELECT *, row_number() OVER (PARTITION BY consulta ORDER BY distancia) AS orden
+    FROM puntuados
+) p
+WHERE orden <= %(k)s
+ORDER BY consulta, orden
+;'''
@@ -0,0 +1,45 @@
+# Librerías para levantar servidores HTTP locales que sustituyen a las webs y APIs reales en las pruebas
+import functools
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Librerías para gestionar rutas y poder importar `src` desde la raíz del repositorio
+import os
+import sys
+
+import pytest
+
+ruta_repositorio = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ruta_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+sys.path.insert(0, ruta_repositorio)
+
+
+class ManejadorSilencioso(SimpleHTTPRequestHandler):
+    """
+    Sirve los ficheros de una carpeta sin escribir cada petición por pantalla.
+    """
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar_servidor(manejador):
+    """
+    Arranca un servidor HTTP en un puerto libre de localhost, en un hilo aparte.
+    Devuelve el servidor y su URL base (sin barra final).
+    """
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+@pytest.fixture
+def servidor_fixtures():
+    """
+    Servidor con las copias locales de las páginas de `tests/fixtures`. Devuelve su URL base.
+    """
+    servidor, url = arrancar_servidor(functools.partial(ManejadorSilencioso, directory=ruta_fixtures))
+    yield url
+    servidor.shutdown()
+    servidor.server_close()
@@ -0,0 +1,127 @@
+# Pruebas de `descargar_paginas` y `LimitadorTokens` contra un servidor local que imita la API de RapidAPI.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from conftest import arrancar_servidor
+from src import soporte_funciones as sf
+
+
+class ApiFalsa:
+    """
+    Estado del servidor local: cuántas veces se ha pedido cada página, cuándo llegó cada petición
+    y qué respuestas de error tiene que dar antes de contestar bien.
+
+    Parámetros:
+    errores (dict): {página: lista de (código, cabeceras)} que se devuelven, en orden, en las primeras peticiones de la página.
+    """
+
+    def __init__(self, errores=None):
+        self.errores = {pagina: list(respuestas) for pagina, respuestas in (errores or {}).items()}
+        self.peticiones = {}
+        self.instantes = []
+        self.lock = threading.Lock()
+
+    def manejador(self):
+        api = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                pagina = int(parse_qs(urlparse(self.path).query)["page"][0])
+                with api.lock:
+                    api.instantes.append(time.monotonic())
+                    api.peticiones[pagina] = api.peticiones.get(pagina, 0) + 1
+                    error = api.errores[pagina].pop(0) if api.errores.get(pagina) else None
+
+                if error is not None:
+                    codigo, cabeceras = error
+                    self.send_response(codigo)
+                    for clave, valor in cabeceras.items():
+                        self.send_header(clave, valor)
+                    self.end_headers()
+                    return
+
+                # Las primeras páginas tardan más, para que las respuestas lleguen desordenadas
+                time.sleep(0.02 * max(0, 5 - pagina))
+                cuerpo = json.dumps({"page": pagina, "results": [{"id": pagina}]}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        return Manejador
+
+
+@pytest.fixture
+def api():
+    servidores = []
+
+    def levantar(errores=None):
+        estado = ApiFalsa(errores)
+        servidor, url = arrancar_servidor(estado.manejador())
+        servidores.append(servidor)
+        return estado, f"{url}/search"
+
+    yield levantar
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_paginas_en_orden_y_reintento_de_429_y_5xx(api):
+    estado, url = api({2: [(429, {"Retry-After": "0.2"})], 4: [(503, {}), (502, {})]})
+    lista_params = [{"page": str(pagina)} for pagina in range(1, 7)]
+
+    inicio = time.monotonic()
+    resultados = sf.descargar_paginas(url, {}, lista_params, max_concurrencia=4, peticiones_por_segundo=100,
+                                      rafaga=10, espera_base=0.05)
+
+    assert [resultado["page"] for resultado in resultados] == [1, 2, 3, 4, 5, 6]
+    assert estado.peticiones == {1: 1, 2: 2, 3: 1, 4: 3, 5: 1, 6: 1}
+    # La página 2 respeta el Retry-After y la 4 espera 0.05 s y luego 0.1 s (espera exponencial)
+    assert time.monotonic() - inicio >= 0.2
+
+
+def test_pagina_que_agota_los_reintentos_se_omite(api):
+    estado, url = api({3: [(500, {})] * 3})
+    lista_params = [{"page": str(pagina)} for pagina in range(1, 5)]
+
+    resultados = sf.descargar_paginas(url, {}, lista_params, max_concurrencia=2, peticiones_por_segundo=100,
+                                      rafaga=10, reintentos=2, espera_base=0.01)
+
+    assert [resultado["page"] for resultado in resultados] == [1, 2, 4]
+    assert estado.peticiones[3] == 3
+
+
+def test_no_se_supera_la_tasa_de_peticiones(api):
+    estado, url = api()
+    tasa, rafaga = 10, 3
+    lista_params = [{"page": str(pagina)} for pagina in range(1, 13)]
+
+    sf.descargar_paginas(url, {}, lista_params, max_concurrencia=6, peticiones_por_segundo=tasa, rafaga=rafaga)
+
+    # Tras la ráfaga inicial, la petición i-ésima no puede llegar antes de (i - rafaga + 1) / tasa segundos
+    instantes = sorted(estado.instantes)
+    for indice, instante in enumerate(instantes):
+        assert instante - instantes[0] >= (indice - rafaga + 1) / tasa - 0.02
+
+
+def test_limitador_deja_pasar_la_rafaga_y_despues_la_tasa():
+    limitador = sf.LimitadorTokens(tasa=20, capacidad=5)
+
+    inicio = time.monotonic()
+    for _ in range(5):
+        limitador.adquirir()
+    assert time.monotonic() - inicio < 0.05
+
+    for _ in range(10):
+        limitador.adquirir()
+    assert time.monotonic() - inicio >= 10 / 20 - 0.02
@@ -0,0 +1,163 @@
+# Pruebas de `descargar_csv` y `descargar_referencias` contra un servidor local que devuelve respuestas grabadas de
+# las descargas directas del INE (`tests/fixtures/ine/31097.csv`, extracto de la tabla completa con otros municipios,
+# secciones y renta por persona) y del Ayuntamiento (`tests/fixtures/ayuntamiento/extranjeros_madrid.csv`).
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from conftest import arrancar_servidor, ruta_fixtures
+from src import soporte_funciones as sf
+
+respuestas_grabadas = {
+    "/ine/31097.csv": os.path.join(ruta_fixtures, "ine", "31097.csv"),
+    "/ayuntamiento/extranjeros_madrid.csv": os.path.join(ruta_fixtures, "ayuntamiento", "extranjeros_madrid.csv"),
+}
+
+
+class ServidorGrabado:
+    """
+    Estado del servidor local: qué cuerpo devuelve cada ruta, si envía ETag y Last-Modified,
+    qué errores da antes de contestar bien y qué cabeceras condicionales ha recibido.
+
+    Parámetros:
+    condicional (bool): Si es True, envía ETag y Last-Modified y responde 304 a un If-None-Match que coincide.
+    errores (list): Códigos de error que se devuelven, en orden, en las primeras peticiones.
+    """
+
+    def __init__(self, condicional=True, errores=None):
+        self.cuerpos = {}
+        for ruta, fichero in respuestas_grabadas.items():
+            with open(fichero, "rb") as file:
+                self.cuerpos[ruta] = file.read()
+        self.condicional = condicional
+        self.errores = list(errores or [])
+        self.peticiones = []
+        self.lock = threading.Lock()
+
+    def manejador(self):
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with servidor.lock:
+                    servidor.peticiones.append((self.path, self.headers.get("If-None-Match")))
+                    error = servidor.errores.pop(0) if servidor.errores else None
+                if error is not None:
+                    self.send_response(error)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                cuerpo = servidor.cuerpos[self.path]
+                etag = f'"{hashlib.sha256(cuerpo).hexdigest()[:16]}"'
+                if servidor.condicional and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv; charset=utf-8")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                if servidor.condicional:
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", "Thu, 01 Oct 2026 08:00:00 GMT")
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        return Manejador
+
+
+@pytest.fixture
+def servidor(monkeypatch, tmp_path):
+    # Los metadatos de las descargas se guardan en una caché propia de cada prueba
+    monkeypatch.setattr(sf, "ruta_cache", str(tmp_path / "cache"))
+    servidores = []
+
+    def levantar(**kwargs):
+        estado = ServidorGrabado(**kwargs)
+        http, url = arrancar_servidor(estado.manejador())
+        servidores.append(http)
+        urls = {"ingresos": f"{url}/ine/31097.csv", "poblacion": f"{url}/ayuntamiento/extranjeros_madrid.csv"}
+        return estado, urls
+
+    yield levantar
+    for http in servidores:
+        http.shutdown()
+        http.server_close()
+
+
+def test_segunda_descarga_condicional_sin_cambios(servidor, tmp_path):
+    estado, urls = servidor()
+    carpeta = tmp_path / "origen"
+    carpeta.mkdir()
+
+    primera = sf.descargar_referencias(carpeta=str(carpeta), urls=urls).set_index("serie")
+    assert list(primera["estado"]) == ["descargado", "descargado"]
+    # Del extracto del INE sólo quedan los 21 distritos de Madrid en los dos años, sin secciones ni otros municipios
+    assert primera.loc["ingresos", "filas"] == 21 * 2
+    assert primera.loc["poblacion", "filas"] == 21 * 5
+    assert primera.loc["ingresos", "bytes"] == os.path.getsize(respuestas_grabadas["/ine/31097.csv"])
+
+    segunda = sf.descargar_referencias(carpeta=str(carpeta), urls=urls).set_index("serie")
+    assert list(segunda["estado"]) == ["sin cambios", "sin cambios"]
+    assert list(segunda["bytes"]) == [0, 0]
+    assert list(segunda["filas"]) == list(primera["filas"])
+    # La segunda petición de cada serie lleva el ETag de la primera
+    assert sum(etag is not None for _, etag in estado.peticiones) == 2
+    assert sorted(os.listdir(carpeta)) == ["extranjeros_madrid.csv", "ingresos_hogares_distrito.csv"]
+
+
+def test_servidor_sin_etag_no_reescribe_el_fichero(servidor, tmp_path):
+    _, urls = servidor(condicional=False)
+    ruta = tmp_path / "ingresos_hogares_distrito.csv"
+
+    assert sf.descargar_referencias(carpeta=str(tmp_path), series=["ingresos"], urls=urls)["estado"][0] == "descargado"
+    modificado = os.path.getmtime(ruta)
+    resultado = sf.descargar_referencias(carpeta=str(tmp_path), series=["ingresos"], urls=urls)
+
+    # Sin petición condicional se descarga de nuevo, pero el fichero sólo se sustituye si cambia el contenido
+    assert resultado["estado"][0] == "sin cambios"
+    assert resultado["bytes"][0] > 0
+    assert os.path.getmtime(ruta) == modificado
+
+
+def test_descarga_no_valida_conserva_el_fichero_anterior(servidor, tmp_path):
+    estado, urls = servidor()
+    ruta = tmp_path / "ingresos_hogares_distrito.csv"
+    sf.descargar_referencias(carpeta=str(tmp_path), series=["ingresos"], urls=urls)
+    anterior = ruta.read_bytes()
+
+    # El servidor pasa a devolver una página HTML en lugar del CSV, como cuando el INE cambia la dirección
+    estado.cuerpos["/ine/31097.csv"] = b"<!DOCTYPE html><html><body>Tabla no disponible</body></html>"
+    with pytest.raises(ValueError, match="ingresos"):
+        sf.descargar_referencias(carpeta=str(tmp_path), series=["ingresos"], urls=urls, forzar=True)
+
+    assert ruta.read_bytes() == anterior
+    assert not (tmp_path / "ingresos_hogares_distrito.csv.parcial").exists()
+
+
+def test_reintento_ante_errores_del_servidor(servidor, tmp_path):
+    estado, urls = servidor(errores=[503, 429])
+    ruta = tmp_path / "ingresos_hogares_distrito.csv"
+
+    resultado = sf.descargar_csv(urls["ingresos"], str(ruta), espera_base=0.01)
+
+    assert resultado["estado"] == "descargado"
+    assert len(estado.peticiones) == 3
+    assert ruta.read_bytes() == estado.cuerpos["/ine/31097.csv"]
+
+
+def test_errores_persistentes_se_propagan(servidor, tmp_path):
+    estado, urls = servidor(errores=[503] * 3)
+    ruta = tmp_path / "ingresos_hogares_distrito.csv"
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        sf.descargar_csv(urls["ingresos"], str(ruta), reintentos=2, espera_base=0.01)
+    assert len(estado.peticiones) == 3
+    assert not ruta.exists()
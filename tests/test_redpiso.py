@@ -0,0 +1,84 @@
+# Pruebas del parser de Redpiso (`iterar_anuncios_redpiso`, `dataframe_redpiso` y `transformar_redpiso`) con las copias
+# de páginas de resultados de `tests/fixtures/redpiso`, que incluyen tarjetas sin precio, sin descripción o con precio
+# "A consultar", y elementos fuera de las tarjetas que el parser tiene que saltar.
+import gzip
+import os
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from conftest import ruta_fixtures
+from src import soporte_funciones as sf
+
+carpeta_paginas = os.path.join(ruta_fixtures, "redpiso", "alquiler-viviendas", "madrid", "madrid")
+paginas = [os.path.join(carpeta_paginas, f"pagina-{pagina}") for pagina in (1, 2, 3)]
+
+
+def test_una_fila_por_tarjeta_y_en_orden():
+    anuncios = list(sf.iterar_anuncios_redpiso(paginas))
+
+    # El banner y el script de la primera página tienen h3/h5 o el texto "property-list", pero no son tarjetas
+    assert len(anuncios) == 5 + 3
+    assert [anuncio["Precio"] for anuncio in anuncios] == ["850 €/mes", "1.100 €/mes", "A consultar", "744 €/mes", None,
+                                                           "790 €/mes", "1.050 €/mes", "1.050 €/mes"]
+    assert anuncios[1] == {
+        "Descripcion": "Piso en alquiler en Calle Cristobal Bordiu, Ríos Rosas, Chamberí, Madrid, Madrid",
+        "Precio": "1.100 €/mes",
+        "URL": "https://www.redpiso.es/inmueble/piso-en-alquiler-en-calle-cristobal-bordiu-rp2311000102",
+    }
+    assert anuncios[6]["Descripcion"] is None
+
+
+def test_mismo_resultado_con_cualquier_entrada(tmp_path):
+    # Las páginas comprimidas como las guarda `scraping_alquileres_redpiso`, en bytes, en texto y con BeautifulSoup
+    comprimidas = []
+    for ruta in paginas:
+        destino = tmp_path / f"{os.path.basename(ruta)}.html.gz"
+        with open(ruta, "rb") as original, gzip.open(destino, "wb") as file:
+            file.write(original.read())
+        comprimidas.append(str(destino))
+    contenidos = []
+    for ruta in paginas:
+        with open(ruta, "rb") as file:
+            contenidos.append(file.read())
+
+    esperado = sf.dataframe_redpiso(paginas)
+    for entrada in (comprimidas, contenidos, [contenido.decode("utf-8") for contenido in contenidos],
+                    [BeautifulSoup(contenido, "html.parser") for contenido in contenidos]):
+        df_redpiso = sf.dataframe_redpiso(entrada)
+        pd.testing.assert_frame_equal(df_redpiso, esperado)
+        assert df_redpiso.attrs["contadores"] == esperado.attrs["contadores"]
+
+
+def test_contadores_y_precios():
+    df_redpiso = sf.dataframe_redpiso(paginas)
+
+    assert df_redpiso.attrs["contadores"] == {"tarjetas": 8, "descartadas_sin_precio": 1, "sin_descripcion": 1,
+                                              "precio_a_consultar": 1}
+    assert str(df_redpiso["Precio"].dtype) == "Int32"
+    assert df_redpiso["Precio"].tolist() == [850, 1100, pd.NA, 744, 790, 1050, 1050]
+    assert df_redpiso["Descripcion"][5] == "Sin descripción"
+
+
+def test_pagina_grande_en_streaming(tmp_path):
+    tarjeta = ('<div class="property-list"><a href="https://www.redpiso.es/inmueble/rp{0}">x</a>'
+               '<h3>{0} €</h3><h5>Piso en alquiler en Retiro, Madrid, Madrid</h5></div>')
+    ruta = tmp_path / "pagina-grande.html.gz"
+    with gzip.open(ruta, "wt", encoding="utf-8") as file:
+        file.write("<!DOCTYPE html><!-- comentario --><html><body><main>")
+        for numero in range(20000):
+            file.write(tarjeta.format(numero))
+        file.write("</main></body></html>")
+
+    precios = [anuncio["Precio"] for anuncio in sf.iterar_anuncios_redpiso([str(ruta)])]
+    assert precios == [f"{numero} €" for numero in range(20000)]
+
+
+def test_transformar_asigna_distritos():
+    df_redpiso = sf.transformar_redpiso(paginas)
+
+    # Se descartan el precio "A consultar" y la tarjeta sin descripción, en la que no se encuentra el distrito
+    assert df_redpiso["ID_Distrito"].tolist() == [17, 7, 15, 21, 3]
+    assert df_redpiso["Precio"].tolist() == [850, 1100, 744, 790, 1050]
+    assert df_redpiso["Descripcion"][0] == "Piso En Alquiler En Villaverde, Madrid, Madrid"
+    assert list(df_redpiso.columns) == ["ID_Distrito", "Precio", "Descripcion", "URL"]
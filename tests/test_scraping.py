@@ -0,0 +1,189 @@
+# Pruebas de los scrapers con Selenium (`scraping_alquileres_redpiso`, `scraping_ayuntamiento` y `scraping_ine`)
+# contra copias locales de las páginas. En lugar de Chrome se usa un navegador mínimo que carga el HTML del
+# servidor local, busca los elementos con los mismos selectores CSS y descarga los enlaces `download` en la carpeta
+# que se le indica con `Page.setDownloadBehavior`, igual que Chrome.
+import gzip
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+from conftest import ruta_fixtures
+from src import soporte_funciones as sf
+
+
+class ElementoFalso:
+    def __init__(self, navegador, etiqueta):
+        self.navegador = navegador
+        self.etiqueta = etiqueta
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+    def is_selected(self):
+        return self.etiqueta.has_attr("selected")
+
+    def click(self):
+        self.navegador.clicks.append(self.etiqueta.get("id") or self.etiqueta.name)
+        if self.etiqueta.name == "option":
+            self.etiqueta["selected"] = ""
+        elif self.etiqueta.name == "a" and self.etiqueta.has_attr("download"):
+            self.navegador.descargar(urljoin(self.navegador.url_documento, self.etiqueta["href"]))
+
+
+class CambioContextoFalso:
+    def __init__(self, navegador):
+        self.navegador = navegador
+
+    def frame(self, elemento):
+        self.navegador.cargar_documento(urljoin(self.navegador.url, elemento.etiqueta["src"]))
+
+    def default_content(self):
+        self.navegador.cargar_documento(self.navegador.url)
+
+
+class NavegadorFalso:
+    """
+    Sustituto de `webdriver.Chrome` con lo que usan los scrapers: `get`, `find_element` por selector CSS o id,
+    `page_source`, `execute_script`, `switch_to` y `execute_cdp_cmd` para la carpeta de descargas.
+    Las descargas se escriben primero como `.crdownload` y se renombran un poco después, como en Chrome.
+    """
+
+    def __init__(self, carpeta_descarga):
+        self.carpeta_descarga = carpeta_descarga
+        self.url = None
+        self.clicks = []
+        self.switch_to = CambioContextoFalso(self)
+
+    def cargar_documento(self, url):
+        self.url_documento = url
+        self.html = requests.get(url, timeout=5).content.decode("utf-8")
+        self.sopa = BeautifulSoup(self.html, "html.parser")
+
+    def get(self, url):
+        self.url = url
+        self.cargar_documento(url)
+
+    @property
+    def page_source(self):
+        return self.html
+
+    def find_element(self, by, selector):
+        etiqueta = self.sopa.select_one(f"#{selector}" if by == By.ID else selector)
+        if etiqueta is None:
+            raise NoSuchElementException(selector)
+        return ElementoFalso(self, etiqueta)
+
+    def execute_script(self, *args):
+        return None
+
+    def execute_cdp_cmd(self, comando, parametros):
+        assert comando == "Page.setDownloadBehavior"
+        self.carpeta_descarga = parametros["downloadPath"]
+
+    def descargar(self, url):
+        contenido = requests.get(url, timeout=5).content
+        ruta = os.path.join(self.carpeta_descarga, os.path.basename(url))
+        with open(f"{ruta}.crdownload", "wb") as fichero:
+            fichero.write(contenido)
+
+        def terminar():
+            time.sleep(0.2)
+            os.replace(f"{ruta}.crdownload", ruta)
+
+        threading.Thread(target=terminar).start()
+
+    def quit(self):
+        pass
+
+
+class PoolFalso(sf.PoolNavegadores):
+    """
+    `PoolNavegadores` que arranca navegadores falsos y guarda los que ha arrancado.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.arrancados = []
+
+    def _arrancar(self):
+        navegador = NavegadorFalso(self.carpeta_descarga)
+        self.arrancados.append(navegador)
+        return navegador
+
+
+def test_redpiso_guarda_las_paginas_en_orden(servidor_fixtures, tmp_path):
+    pool = PoolFalso(tamanio=2, espera=0.5)
+    rutas = sf.scraping_alquileres_redpiso(3, carpeta_html=str(tmp_path), pool=pool,
+                                           url_base=f"{servidor_fixtures}/redpiso")
+
+    assert rutas == [str(tmp_path / f"pagina-{pagina}.html.gz") for pagina in (1, 2, 3)]
+    for pagina, ruta in enumerate(rutas, start=1):
+        with gzip.open(ruta, "rt", encoding="utf-8") as guardada, \
+                open(os.path.join(ruta_fixtures, "redpiso", "alquiler-viviendas", "madrid", "madrid", f"pagina-{pagina}"),
+                     encoding="utf-8") as original:
+            assert guardada.read() == original.read()
+    # Las tres páginas se reparten entre dos navegadores, que se reutilizan
+    assert len(pool.arrancados) == 2
+    pool.cerrar()
+
+
+def test_redpiso_sin_paginas_no_arranca_navegadores(tmp_path):
+    assert sf.scraping_alquileres_redpiso(0, carpeta_html=str(tmp_path)) == []
+
+
+def test_ayuntamiento_descarga_el_csv(servidor_fixtures, tmp_path):
+    pool = PoolFalso(tamanio=1, carpeta_descarga=str(tmp_path), espera=2)
+    ruta = sf.scraping_ayuntamiento(pool=pool, url=f"{servidor_fixtures}/ayuntamiento/serie.html")
+
+    assert ruta == str(tmp_path / "extranjeros_madrid.csv")
+    assert os.listdir(tmp_path) == ["extranjeros_madrid.csv"]
+    assert pool.arrancados[0].clicks == ["iam-cookie-control-modal-action-primary", "check186", "checkTotales650",
+                                         "check435", "check360", "check382", "botonCsv"]
+    # Tras la descarga, el navegador vuelve a descargar en la carpeta del pool
+    assert pool.arrancados[0].carpeta_descarga == str(tmp_path)
+    assert len(sf.leer_poblacion_ayuntamiento(ruta)) == 21 * 5
+    pool.cerrar()
+
+
+def test_ine_descarga_el_csv_desde_el_iframe(servidor_fixtures, tmp_path):
+    pool = PoolFalso(tamanio=1, carpeta_descarga=str(tmp_path), espera=2)
+    ruta = sf.scraping_ine(pool=pool, url=f"{servidor_fixtures}/ine/tabla.html")
+
+    assert ruta == str(tmp_path / "ingresos_hogares_distrito.csv")
+    assert os.listdir(tmp_path) == ["ingresos_hogares_distrito.csv"]
+    # Tras la descarga se vuelve al documento principal
+    assert pool.arrancados[0].url_documento.endswith("/ine/tabla.html")
+    assert len(sf.leer_ingresos_ine(ruta)) == 14
+    pool.cerrar()
+
+
+def test_descargas_simultaneas_en_la_misma_carpeta_no_se_mezclan(servidor_fixtures, tmp_path):
+    resultados = {}
+
+    def descargar(nombre, funcion, url):
+        pool = PoolFalso(tamanio=1, carpeta_descarga=str(tmp_path), espera=2)
+        resultados[nombre] = funcion(pool=pool, url=url)
+        pool.cerrar()
+
+    hilos = [
+        threading.Thread(target=descargar, args=("ayuntamiento", sf.scraping_ayuntamiento,
+                                                 f"{servidor_fixtures}/ayuntamiento/serie.html")),
+        threading.Thread(target=descargar, args=("ine", sf.scraping_ine, f"{servidor_fixtures}/ine/tabla.html")),
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert resultados == {"ayuntamiento": str(tmp_path / "extranjeros_madrid.csv"),
+                          "ine": str(tmp_path / "ingresos_hogares_distrito.csv")}
+    assert sorted(os.listdir(tmp_path)) == ["extranjeros_madrid.csv", "ingresos_hogares_distrito.csv"]